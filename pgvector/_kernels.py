@@ -0,0 +1,36 @@
+"""
+Numba-compiled cosine distance kernels for re-ranking candidate embeddings in process.
+
+Used by PgvectorService when simsimd is not installed. Compiled code is cached on disk
+(cache=True), so only the first run pays the JIT cost. Numba targets the host CPU by
+default; when building the cache for another machine, pin the target explicitly,
+e.g. NUMBA_CPU_NAME=skylake-avx512 for AVX-512 servers.
+Inputs must be writable, contiguous float32 arrays: np.array(x, dtype=np.float32).
+"""
+
+import numpy as np
+from numba import njit
+
+
+@njit("f4(f4[::1], f4[::1])", fastmath=True, cache=True)
+def cosine_dist(a, b):
+    """1 - cos(a, b), computed in a single pass over both vectors."""
+    dot = np.float32(0.0)
+    norm_a = np.float32(0.0)
+    norm_b = np.float32(0.0)
+    for i in range(a.shape[0]):
+        dot += a[i] * b[i]
+        norm_a += a[i] * a[i]
+        norm_b += b[i] * b[i]
+    if norm_a == 0.0 or norm_b == 0.0:
+        return np.float32(1.0)
+    return np.float32(1.0) - dot / np.sqrt(norm_a * norm_b)
+
+
+@njit("f4[::1](f4[::1], f4[:, ::1])", fastmath=True, cache=True)
+def cosine_dist_rows(query, matrix):
+    """Cosine distance from query to every row of matrix."""
+    out = np.empty(matrix.shape[0], dtype=np.float32)
+    for i in range(matrix.shape[0]):
+        out[i] = cosine_dist(query, matrix[i])
+    return out
@@ -6,12 +6,17 @@ See pgvector/README.md for full setup (PostgreSQL, pgvector extension, .env conf
 """
 
 from dotenv import load_dotenv
+import langchain_core
+import pydantic
 from langchain_community.document_loaders import TextLoader
 from langchain_text_splitters import CharacterTextSplitter
 from langchain_community.vectorstores import Pinecone
 from langchain_community.vectorstores.pgvector import PGVector
-from pgvector_service import PgvectorService
+from pgvector_service import PgvectorService, get_local_embeddings
+import asyncio
+import hashlib
 import os
+import pickle
 import time
 
 load_dotenv()
@@ -22,9 +27,8 @@ load_dotenv()
 # OpenAI: Requires OPENAI_API_KEY. May be restricted in some regions.
 # HuggingFace: Local model, no API key. Set USE_LOCAL_EMBEDDINGS=true in .env
 if os.getenv("USE_LOCAL_EMBEDDINGS", "").lower() in ("true", "1", "yes"):
-    from langchain_community.embeddings import HuggingFaceEmbeddings
-
-    embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
+    # Batched encoding, FP16 on GPU (see get_local_embeddings)
+    embeddings = get_local_embeddings()
     print("Using local HuggingFace embeddings (all-MiniLM-L6-v2)\n")
 else:
     from langchain_openai import OpenAIEmbeddings
@@ -43,17 +47,47 @@ DATA_FILE = os.path.join(
     "The Project Gutenberg eBook of A Christmas Carol in Prose; Being a Ghost Story of Christmas.txt",
 )
 
-# Load the text file into LangChain Document objects
-loader = TextLoader(DATA_FILE)
-documents = loader.load()
+# Split chunks are cached here, keyed by file, modification time and splitter settings
+CHUNK_CACHE_DIR = os.path.join(SCRIPT_DIR, ".cache", "chunks")
+# Part of the cache key, so pickles from another format or library version are not reused
+CHUNK_CACHE_VERSION = f"1:langchain_core={langchain_core.__version__}:pydantic={pydantic.VERSION}"
+
+
+def load_chunks(path, chunk_size, chunk_overlap):
+    """Load a text file and split it into chunks, reusing the cached split if unchanged."""
+    key = f"{CHUNK_CACHE_VERSION}:{path}:{os.path.getmtime(path)}:{chunk_size}:{chunk_overlap}"
+    key = hashlib.sha1(key.encode()).hexdigest()
+    cache_file = os.path.join(CHUNK_CACHE_DIR, f"{key}.pkl")
+    if os.path.exists(cache_file):
+        try:
+            with open(cache_file, "rb") as f:
+                return pickle.load(f)
+        except Exception:
+            pass  # Damaged or incompatible cache file: rebuild it below
+
+    # Load the text file into LangChain Document objects
+    documents = TextLoader(path).load()
+    text_splitter = CharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    chunks = text_splitter.split_documents(documents)
+
+    # Write to a temp file and rename, so an interrupted run never leaves a partial pickle
+    os.makedirs(CHUNK_CACHE_DIR, exist_ok=True)
+    tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+    with open(tmp_file, "wb") as f:
+        pickle.dump(chunks, f)
+    os.replace(tmp_file, cache_file)
+    return chunks
+
 
 # Split into chunks: 2000 chars each, no overlap. Smaller chunks = more precise search.
-text_splitter = CharacterTextSplitter(chunk_size=2000, chunk_overlap=0)
-docs = text_splitter.split_documents(documents)
+docs = load_chunks(DATA_FILE, chunk_size=2000, chunk_overlap=0)
 
 # Query we'll use for similarity search
 query = "The Project Gutenberg eBook of A Christmas Carol in Prose; Being a Ghost Story of Christmas"
 
+# Embed the query once so the timing loops below measure search, not the embedding call
+query_vector = embeddings.embed_query(query)
+
 
 # -----------------------------------------------------------------------------
 # STEP 3: Pinecone Comparison (Optional)
@@ -78,6 +112,25 @@ def calculate_average_execution_time(func, *args, **kwargs):
     return
 
 
+async def calculate_average_execution_time_async(func, *args, session_factory, **kwargs):
+    # Open the session (connection) once, so only the calls made on it are timed
+    total_execution_time = 0
+    num_runs = 10
+    async with session_factory() as session:
+        for _ in range(num_runs):
+            start_time = time.time()
+            result = await func(session, *args, **kwargs)
+            end_time = time.time()
+            execution_time = end_time - start_time
+            total_execution_time += execution_time
+    average_execution_time = round(total_execution_time / num_runs, 2)
+    print(result)
+    print(
+        f"\nThe function took an average of {average_execution_time} seconds to execute."
+    )
+    return
+
+
 # Create Pinecone index and run similarity search (only if API key is set)
 if os.getenv("PINECONE_API_KEY"):
     from pinecone import Pinecone as PineconeClient, ServerlessSpec
@@ -94,12 +147,12 @@ if os.getenv("PINECONE_API_KEY"):
         )
     pinecone_docsearch = Pinecone.from_existing_index(index_name, embeddings)
 
-    def run_query_pinecone(docsearch, query):
-        docs = docsearch.similarity_search(query, k=4)
+    def run_query_pinecone(docsearch, query_vector):
+        docs = docsearch.similarity_search_by_vector(query_vector, k=4)
         return docs[0].page_content
 
     calculate_average_execution_time(
-        run_query_pinecone, docsearch=pinecone_docsearch, query=query
+        run_query_pinecone, docsearch=pinecone_docsearch, query_vector=query_vector
     )
 else:
     print("Skipping Pinecone (PINECONE_API_KEY not set). Continuing with PGVector...\n")
@@ -115,7 +168,7 @@ COLLECTION_NAME = "The Project Gutenberg eBook of A Christmas Carol in Prose"
 
 # Build connection string from env vars (PGVECTOR_USER, PGVECTOR_PASSWORD, etc.)
 CONNECTION_STRING = PGVector.connection_string_from_db_params(
-    driver=os.environ.get("PGVECTOR_DRIVER", "psycopg2"),
+    driver=os.environ.get("PGVECTOR_DRIVER", "psycopg"),
     host=os.environ.get("PGVECTOR_HOST", "localhost"),
     port=int(os.environ.get("PGVECTOR_PORT", "5432")),
     database=os.environ.get("PGVECTOR_DATABASE", "pgvector"),
@@ -126,62 +179,59 @@ CONNECTION_STRING = PGVector.connection_string_from_db_params(
 # -----------------------------------------------------------------------------
 # STEP 5: Store Documents in PGVector
 # -----------------------------------------------------------------------------
+# PgvectorService queries the stored embeddings over a pooled psycopg 3 connection
+pg = PgvectorService(CONNECTION_STRING, embeddings=embeddings)
+
 # This creates the langchain_pg_collection and langchain_pg_embedding tables,
 # generates embeddings for each chunk, and inserts them into PostgreSQL.
-db = PGVector.from_documents(
-    embedding=embeddings,
-    documents=docs,
-    collection_name=COLLECTION_NAME,
-    connection_string=CONNECTION_STRING,
-    pre_delete_collection=False,
-)
-
-# Load the store for querying (connects to existing collection)
-pgvector_docsearch = PGVector(
-    collection_name=COLLECTION_NAME,
-    connection_string=CONNECTION_STRING,
-    embedding_function=embeddings,
-)
+# If the collection is left over from an earlier run it is replaced, not appended to.
+pg.update_collection(docs=docs, collection_name=COLLECTION_NAME)
 
 # -----------------------------------------------------------------------------
 # STEP 6: Run Similarity Search
 # -----------------------------------------------------------------------------
-# Converts query to embedding, finds nearest chunks by cosine similarity,
-# returns top k results. Runs 10 times to measure average execution time.
+# Finds the nearest chunks to the (pre-computed) query embedding by cosine similarity,
+# returns top k results. Runs 10 times on one connection to measure average execution time.
+# Note: PgvectorService searches every collection in the table, not only COLLECTION_NAME.
+# At this point that is the only collection (the second one is added in Step 7), so the
+# comparison with Pinecone still covers the same documents.
 
 
-def run_query_pgvector(docsearch, query):
-    docs = docsearch.similarity_search(query, k=4)
-    result = docs[0].page_content
+async def run_query_pgvector(connection, docsearch, query_vector):
+    docs = await docsearch.similarity_search_by_vector(query_vector, k=4, connection=connection)
+    result = docs[0][0].page_content
     return result
 
 
-calculate_average_execution_time(
-    run_query_pgvector, docsearch=pgvector_docsearch, query=query
-)
+async def benchmark_pgvector(docsearch):
+    try:
+        await calculate_average_execution_time_async(
+            run_query_pgvector,
+            session_factory=docsearch.connect,
+            docsearch=docsearch,
+            query_vector=query_vector,
+        )
+    finally:
+        await docsearch.dispose()
+
+
+asyncio.run(benchmark_pgvector(pg))
 
 
 # -----------------------------------------------------------------------------
 # STEP 7: Add a Second Collection
 # -----------------------------------------------------------------------------
 # Load Romeo and Juliet, split with different chunk size (1000), store as new collection.
-loader = TextLoader(
-    os.path.join(SCRIPT_DIR, "..", "data", "The Project Gutenberg eBook of Romeo and Juliet.txt")
+new_docs = load_chunks(
+    os.path.join(SCRIPT_DIR, "..", "data", "The Project Gutenberg eBook of Romeo and Juliet.txt"),
+    chunk_size=1000,
+    chunk_overlap=0,
 )
-documents = loader.load()
-text_splitter = CharacterTextSplitter(chunk_size=1000, chunk_overlap=0)
-new_docs = text_splitter.split_documents(documents)
 
 
 COLLECTION_NAME_2 = "The Project Gutenberg eBook of Romeo and Juliet"
 
-db = PGVector.from_documents(
-    embedding=embeddings,
-    documents=new_docs,
-    collection_name=COLLECTION_NAME_2,
-    connection_string=CONNECTION_STRING,
-    pre_delete_collection=False,
-)
+pg.update_collection(docs=new_docs, collection_name=COLLECTION_NAME_2)
 
 
 # -----------------------------------------------------------------------------
@@ -189,17 +239,29 @@ db = PGVector.from_documents(
 # -----------------------------------------------------------------------------
 # PgvectorService uses raw SQL to search across all collections and return
 # results with similarity scores. Useful when you have multiple document sets.
-pg = PgvectorService(CONNECTION_STRING, embeddings=embeddings)
-
-
-def run_query_multi_pgvector(docsearch, query):
-    # Returns [(Document, score), ...]; docs[0][0] = top Document, docs[0][1] = its score
-    docs = docsearch.custom_similarity_search_with_scores(query, k=4)
-    result = docs[0][0].page_content
-    print(result)
-
-
-run_query_multi_pgvector(pg, query)
+# Searches are async (psycopg 3), so independent queries can run concurrently.
+
+async def run_query_multi_pgvector(docsearch, query):
+    try:
+        # Returns [(Document, score), ...]; docs[0][0] = top Document, docs[0][1] = its score
+        docs = await docsearch.custom_similarity_search_with_scores(query, k=4)
+        result = docs[0][0].page_content
+        print(result)
+
+        # Two independent questions at once: each runs on its own connection, so they
+        # overlap on the server. Like above, each one searches every collection.
+        questions = [
+            "Who was Scrooge's business partner?",
+            "Why do the Montagues and the Capulets fight?",
+        ]
+        results = await docsearch.similarity_search_many(questions, k=1)
+        for question, docs in zip(questions, results):
+            print(f"\n{question}\n{docs[0][0].page_content[:200]}")
+    finally:
+        await docsearch.dispose()
+
+
+asyncio.run(run_query_multi_pgvector(pg, query))
 
 # -----------------------------------------------------------------------------
 # STEP 9: Delete Collections
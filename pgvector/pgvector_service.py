@@ -13,30 +13,200 @@ from langchain_community.vectorstores.pgvector import (
 )
 from langchain_core.documents import Document
 from langchain_core.embeddings import Embeddings
-from sqlalchemy import create_engine, text
-from sqlalchemy.orm import Session
+from pgvector import HalfVector
+from pgvector.psycopg import register_vector_async
+from sqlalchemy import create_engine, event, make_url, text
+from sqlalchemy.exc import ProgrammingError
+from sqlalchemy.ext.asyncio import create_async_engine
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
+import asyncio
+import functools
+import hashlib
+import io
+import json
 import logging
+import math
+import numpy as np
 import os
+import struct
+import uuid
 
+try:
+    import simsimd
+except ImportError:  # Optional: re-ranking falls back to the Numba kernels
+    simsimd = None
+
+try:
+    from _kernels import cosine_dist_rows
+except ImportError:  # Optional: ...and then to plain numpy
+    cosine_dist_rows = None
+
+# Read .env once at import; services are cheap to construct and may be built per request
+load_dotenv()
 
 # LangChain's internal model for the langchain_pg_embedding table
 EmbeddingStore = _get_embedding_collection_store()[0]
 
+# Approximate nearest neighbour indexes on langchain_pg_embedding. Only one exists at a
+# time: HNSW (better queries) or IVFFlat (much faster to build, for bulk rebuilds).
+HNSW_INDEX_NAME = "idx_embedding_hnsw"
+IVFFLAT_INDEX_NAME = "idx_embedding_ivfflat"
+
+# When there is no index yet, tables above this many vectors get IVFFlat, not HNSW
+IVFFLAT_MIN_VECTORS = 100_000
+
+# Searches fetch k * RERANK_FACTOR index candidates and re-rank them exactly in process
+RERANK_FACTOR = 10
+
+# Nearest neighbours of one query vector. Sent with bind parameters on a single
+# statement text, so psycopg 3 prepares it server-side per connection once it has run
+# prepare_threshold (default 5) times, and later searches skip parsing and planning.
+KNN_SEARCH_SQL = (
+    "SELECT document, custom_id, embedding FROM langchain_pg_embedding "
+    "ORDER BY embedding <=> %b LIMIT %s"
+)
+
+# Per-transaction index search settings (the SET LOCAL equivalents) in one round trip:
+# hnsw.ef_search is the HNSW candidate list size, ivfflat.probes the IVFFlat lists scanned.
+# Each index type ignores the other's setting.
+SEARCH_SETTINGS_SQL = (
+    "SELECT set_config('hnsw.ef_search', %s, true), set_config('ivfflat.probes', '10', true)"
+)
+
+# Binary COPY of new embedding rows (see _pack_copy_rows for the row layout)
+COPY_EMBEDDINGS_SQL = (
+    "COPY langchain_pg_embedding "
+    "(collection_id, embedding, document, cmetadata, custom_id, uuid) "
+    "FROM STDIN WITH (FORMAT BINARY)"
+)
+
+
+def configure_hnsw_params(vector_count):
+    """Pick HNSW (m, ef_construction, ef_search) for the number of stored vectors."""
+    if vector_count < 100_000:
+        return 16, 64, 40
+    elif vector_count < 1_000_000:
+        return 24, 100, 100
+    else:
+        return 32, 128, 200
+
+
+def configure_ivfflat_lists(vector_count):
+    """Pick the IVFFlat list count for the number of stored vectors (about sqrt(rows))."""
+    return max(10, round(math.sqrt(vector_count)))
+
+
+LOCAL_EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+# Embeddings that run a model in this process (see _parallel_embed)
+LOCAL_EMBEDDING_CLASSES = {
+    "HuggingFaceEmbeddings",
+    "HuggingFaceBgeEmbeddings",
+    "HuggingFaceInstructEmbeddings",
+}
+
+
+def get_local_embeddings(model_name=LOCAL_EMBEDDING_MODEL) -> Embeddings:
+    """Local HuggingFace embeddings, encoded in batches (FP16 when a GPU is available)."""
+    import torch
+    from langchain_community.embeddings import HuggingFaceEmbeddings
+
+    if torch.cuda.is_available():
+        model_kwargs = {"device": "cuda", "model_kwargs": {"torch_dtype": torch.float16}}
+    else:
+        # FP16 is slow (or unsupported) for CPU inference, keep FP32 there
+        model_kwargs = {"device": "cpu"}
+    return HuggingFaceEmbeddings(
+        model_name=model_name,
+        model_kwargs=model_kwargs,
+        encode_kwargs={"batch_size": 64, "normalize_embeddings": True},
+    )
+
 
 def _get_embeddings(embeddings=None) -> Embeddings:
     """Get embeddings - use provided or fall back to OpenAI/local based on env."""
     if embeddings is not None:
         return embeddings
     if os.getenv("USE_LOCAL_EMBEDDINGS", "").lower() in ("true", "1", "yes"):
-        from langchain_community.embeddings import HuggingFaceEmbeddings
+        return _default_embeddings(True, LOCAL_EMBEDDING_MODEL)
+    return _default_embeddings(False, None)
 
-        return HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
+
+@functools.lru_cache(maxsize=2)
+def _default_embeddings(use_local, model_name) -> Embeddings:
+    """Build the env-selected embeddings once per process (loading a local model is slow)."""
+    if use_local:
+        return get_local_embeddings(model_name)
     from langchain_openai import OpenAIEmbeddings
 
     return OpenAIEmbeddings()
 
 
+def _pack_copy_rows(
+    collection_id, docs, vectors, type_name="vector", metadata_type="json"
+) -> io.BytesIO:
+    """
+    Build a PostgreSQL binary COPY stream for COPY_EMBEDDINGS_SQL.
+    vector is sent as float32, halfvec as float16 (pgvector's binary formats).
+    cmetadata is JSON text; jsonb's binary format prefixes it with a version byte.
+    """
+
+    def field(value: bytes) -> bytes:
+        return struct.pack(">i", len(value)) + value
+
+    float_code = "e" if type_name == "halfvec" else "f"
+    metadata_prefix = b"\x01" if metadata_type == "jsonb" else b""
+    collection_bytes = field(uuid.UUID(str(collection_id)).bytes)
+
+    buf = io.BytesIO()
+    # Header: signature, flags, header extension length
+    buf.write(b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0))
+    for doc, vector in zip(docs, vectors):
+        dims = len(vector)
+        buf.write(struct.pack(">h", 6))
+        buf.write(collection_bytes)
+        buf.write(field(struct.pack(f">HH{dims}{float_code}", dims, 0, *vector)))
+        buf.write(field(doc.page_content.encode("utf-8")))
+        buf.write(field(metadata_prefix + json.dumps(doc.metadata).encode("utf-8")))
+        buf.write(field(str(uuid.uuid4()).encode("utf-8")))
+        buf.write(field(uuid.uuid4().bytes))
+    # Trailer
+    buf.write(struct.pack(">h", -1))
+    buf.seek(0)
+    return buf
+
+
+def _content_hash(docs, embeddings) -> str:
+    """
+    SHA-1 over the embedding model and the documents' text, to detect an unchanged
+    collection. The model is included so switching models (e.g. USE_LOCAL_EMBEDDINGS)
+    re-embeds instead of keeping vectors of the old model and dimension.
+    """
+    embeddings_class = type(embeddings)
+    model = getattr(embeddings, "model", None) or getattr(embeddings, "model_name", None)
+    digest = hashlib.sha1()
+    digest.update(f"{embeddings_class.__module__}.{embeddings_class.__qualname__}".encode())
+    digest.update(f":{model}\0".encode("utf-8"))
+    for doc in docs:
+        digest.update(doc.page_content.encode("utf-8"))
+        digest.update(b"\0")  # Separator, so ["ab", "c"] and ["a", "bc"] differ
+    return digest.hexdigest()
+
+
+def _register_vector_types(dbapi_connection, connection_record):
+    """Register pgvector's psycopg 3 adapters on each new pooled connection."""
+    dbapi_connection.run_async(register_vector_async)
+
+
+def _as_array(value) -> np.ndarray:
+    """Embedding value loaded by the pgvector adapters (vector or halfvec) as float32."""
+    # Depending on the pgvector version, vectors load as numpy arrays or Vector objects
+    if hasattr(value, "to_numpy"):
+        value = value.to_numpy()
+    return np.asarray(value, dtype=np.float32)
+
+
 class PgvectorService:
     """
     Service for interacting with PGVector using SQLAlchemy and raw SQL.
@@ -44,97 +214,440 @@ class PgvectorService:
     """
 
     def __init__(self, connection_string, embeddings=None):
-        load_dotenv()
         self.embeddings = _get_embeddings(embeddings)
         self.cnx = connection_string
         self.collections = []
-        self.engine = create_engine(self.cnx)
+        self.engine = create_engine(self.cnx, pool_pre_ping=True)
+        # Searches run async on psycopg 3, whatever sync driver the connection string names
+        self.async_engine = create_async_engine(
+            make_url(self.cnx).set(drivername="postgresql+psycopg"), pool_pre_ping=True
+        )
+        # Send and receive vectors in pgvector's binary format instead of text literals
+        event.listen(self.async_engine.sync_engine, "connect", _register_vector_types)
         self.EmbeddingStore = EmbeddingStore
+        self.ef_search = 100
+        self.embedding_type = None  # (type name, dims) of the embedding column, read lazily
+        # Per-instance LRU of query embeddings: repeated queries skip the embedding call
+        self.get_vector = functools.lru_cache(maxsize=1024)(self._embed_query)
 
     # --- Search ---
 
-    def get_vector(self, text):
-        """Convert text to embedding vector (for similarity comparison)."""
-        return self.embeddings.embed_query(text)
+    def _embed_query(self, text) -> np.ndarray:
+        """Convert text to embedding vector (for similarity comparison). Use get_vector."""
+        vector = np.asarray(self.embeddings.embed_query(text), dtype=np.float32)
+        # Cached and shared between callers, so it must not be modified in place
+        vector.flags.writeable = False
+        return vector
 
-    def custom_similarity_search_with_scores(self, query, k=3):
+    async def custom_similarity_search_with_scores(self, query, k=3, connection=None):
         """
         Search across ALL collections using cosine similarity.
         Returns list of (Document, score) tuples. Lower distance = higher similarity.
+        Pass a connection from connect() to reuse it across searches.
         """
-        query_vector = self.get_vector(query)
+        # Embedding is a blocking call (HTTP or local model); keep it off the event loop
+        query_embedding = await asyncio.to_thread(self.get_vector, query)
+        return await self.similarity_search_by_vector(query_embedding, k, connection)
 
-        with Session(self.engine) as session:
-            # Cosine distance: 0 = identical, 2 = opposite. Order by ascending = most similar first.
-            cosine_distance = self.EmbeddingStore.embedding.cosine_distance(
-                query_vector
-            ).label("distance")
+    async def similarity_search_by_vector(self, query_embedding, k=3, connection=None):
+        """Like custom_similarity_search_with_scores, for an already embedded query."""
+        if connection is None:
+            async with self.async_engine.begin() as connection:
+                return await self._search(connection, query_embedding, k)
+        return await self._search(connection, query_embedding, k)
 
-            # Querying the EmbeddingStore table
-            results = (
-                session.query(
-                    self.EmbeddingStore.document,
-                    self.EmbeddingStore.custom_id,
-                    cosine_distance,
-                )
-                .order_by(cosine_distance.asc())
-                .limit(k)
-                .all()
-            )
-        # Convert distance to similarity score: 1 - distance (higher = more similar)
-        docs = [(Document(page_content=result[0]), 1 - result[2]) for result in results]
+    async def _search(self, connection, query_embedding, k):
+        query_embedding = np.asarray(query_embedding, dtype=np.float32)
+        if self.embedding_type is None:
+            self.embedding_type = await connection.run_sync(self._get_embedding_type)
+        if self.embedding_type[0] == "halfvec":
+            query_vector = HalfVector(query_embedding)
+        else:
+            query_vector = query_embedding
+
+        # Candidate list size for the HNSW graph walk (higher = better recall, slower).
+        # HNSW returns at most ef_search rows, so it must cover the over-fetch.
+        ef_search = max(int(self.ef_search), k * RERANK_FACTOR)
+        await connection.exec_driver_sql(SEARCH_SETTINGS_SQL, (str(ef_search),))
+
+        # The index is approximate, so over-fetch candidates (with their embeddings)
+        # and pick the final k below. Cosine distance: 0 = identical, 2 = opposite.
+        # %b in KNN_SEARCH_SQL sends the vector in pgvector's binary format, not as text.
+        result = await connection.exec_driver_sql(KNN_SEARCH_SQL, (query_vector, k * RERANK_FACTOR))
+        results = result.all()
+        if not results:
+            return []
+
+        # Exact cosine distance on the candidates recovers the recall lost to the index
+        candidates = np.vstack([_as_array(result[2]) for result in results])
+        distances = self._score_candidates(query_embedding, candidates)
+        top = np.argpartition(distances, k)[:k] if len(distances) > k else np.arange(len(distances))
+        top = top[np.argsort(distances[top])]
+
+        # Convert distance to similarity score: 1 - distance (higher = more similar),
+        # for all rows at once; tolist() turns them into Python floats in one call
+        scores = (1.0 - distances[top]).tolist()
+        docs = [
+            (Document(page_content=results[i][0]), score) for i, score in zip(top.tolist(), scores)
+        ]
 
         return docs
 
+    async def search_many(self, queries, k=3):
+        """
+        Run several searches one after another on a single connection, paying the
+        connection checkout once. Returns one result list per query.
+        """
+        async with self.connect() as connection:
+            return [
+                await self.custom_similarity_search_with_scores(query, k, connection)
+                for query in queries
+            ]
+
+    async def similarity_search_many(self, queries, k=3):
+        """
+        Run several searches concurrently, each on its own pooled connection, so the
+        server works on them in parallel. Returns one result list per query.
+        """
+        return await asyncio.gather(
+            *(self.custom_similarity_search_with_scores(query, k) for query in queries)
+        )
+
+    def connect(self):
+        """Open a pooled async connection: `async with service.connect() as connection:`."""
+        return self.async_engine.connect()
+
+    async def dispose(self):
+        """Close pooled async connections. Call before the event loop that used them ends."""
+        await self.async_engine.dispose()
+
+    @staticmethod
+    def rerank_with_simsimd(query_vec, candidate_vecs, k=None):
+        """
+        Exact cosine re-ranking of candidate embeddings (e.g. ANN results from Postgres).
+        Returns (indices, distances) of the best k candidates, most similar first.
+        """
+        distances = PgvectorService._score_candidates(query_vec, candidate_vecs)
+        order = np.argsort(distances)[:k]
+        return order, distances[order]
+
+    @staticmethod
+    def _score_candidates(query_vec, candidate_matrix):
+        """Cosine distance from query_vec to each row of candidate_matrix (float32 array)."""
+        query = np.ascontiguousarray(query_vec, dtype=np.float32)
+        candidates = np.ascontiguousarray(candidate_matrix, dtype=np.float32)
+        if simsimd is not None:
+            return np.asarray(
+                simsimd.cdist(query[None, :], candidates, metric="cosine"), dtype=np.float32
+            )[0]
+        if cosine_dist_rows is not None:
+            # The kernel is compiled for writable arrays; cached query vectors are read-only
+            return cosine_dist_rows(np.array(query), candidates)
+        norms = np.linalg.norm(candidates, axis=1) * np.linalg.norm(query)
+        return (1 - (candidates @ query) / norms).astype(np.float32)
+
     # --- Collection Management ---
 
     def update_pgvector_collection(
-        self, docs, collection_name, overwrite=False
+        self, docs, collection_name, overwrite=False, prefer_fast_build=None, content_hash=None
     ) -> None:
         """
         Create or replace a collection. Generates embeddings and stores in langchain_pg_embedding.
-        overwrite=True: Delete existing collection first (use when refreshing data).
+        overwrite=True: Replace the existing rows (use when refreshing data).
+        prefer_fast_build=True: Index with IVFFlat instead of HNSW (faster build, slower queries).
+        prefer_fast_build=False forces HNSW; None keeps the current index type (see ensure_index).
+        content_hash: Precomputed _content_hash of docs, passed on to bulk_upsert.
         """
         logging.info(f"Creating new collection: {collection_name}")
-        with self.engine.connect() as connection:
-            pgvector = PGVector.from_documents(
-                embedding=self.embeddings,
-                documents=docs,
-                collection_name=collection_name,
-                connection_string=self.cnx,
-                connection=connection,
-                pre_delete_collection=overwrite,
+        # Creates the tables and the collection if missing; rows are added by bulk_upsert.
+        # PGVector uses its own engine: on a borrowed connection its commits never land.
+        PGVector(
+            collection_name=collection_name,
+            connection_string=self.cnx,
+            embedding_function=self.embeddings,
+        )
+        self.bulk_upsert(docs, collection_name, replace=overwrite, content_hash=content_hash)
+        if prefer_fast_build is None:
+            self.ensure_index()
+        else:
+            self.ensure_index("ivfflat" if prefer_fast_build else "hnsw")
+
+    def bulk_upsert(self, docs, collection_name, replace=False, content_hash=None) -> None:
+        """
+        Embed docs in one batch and load them into an existing collection with a
+        single binary COPY, instead of one INSERT per document.
+        replace=True: Swap out the collection's current rows in the same transaction.
+        Records the content hash in the collection's cmetadata (see update_collection);
+        pass content_hash if the caller already computed it for docs.
+        """
+        vectors = self._parallel_embed([doc.page_content for doc in docs])
+
+        with self.engine.begin() as connection:
+            collection_id = connection.execute(
+                text("SELECT uuid FROM langchain_pg_collection WHERE name = :name"),
+                {"name": collection_name},
+            ).scalar_one()
+            type_name, dims = self._get_embedding_type(connection)
+            if dims is not None and vectors and len(vectors[0]) != dims:
+                raise ValueError(
+                    f"Embeddings for {collection_name} have {len(vectors[0])} dimensions, but "
+                    f"langchain_pg_embedding.embedding is fixed at {dims} (set by ensure_index). "
+                    "All collections must use the same embedding model."
+                )
+            # LangChain creates cmetadata as json or jsonb depending on its version
+            metadata_type, _ = self._get_column_type(connection, "cmetadata")
+            if replace:
+                # Only this collection's rows; the table is shared, so no TRUNCATE
+                connection.execute(
+                    text("DELETE FROM langchain_pg_embedding WHERE collection_id = :id"),
+                    {"id": collection_id},
+                )
+                appending = False
+            else:
+                appending = connection.execute(
+                    text(
+                        "SELECT EXISTS (SELECT 1 FROM langchain_pg_embedding "
+                        "WHERE collection_id = :id)"
+                    ),
+                    {"id": collection_id},
+                ).scalar()
+
+            buf = _pack_copy_rows(collection_id, docs, vectors, type_name, metadata_type)
+            # COPY through the driver cursor, inside this transaction
+            with connection.connection.cursor() as cursor:
+                if hasattr(cursor, "copy_expert"):  # psycopg2
+                    cursor.copy_expert(COPY_EMBEDDINGS_SQL, buf)
+                else:  # psycopg 3
+                    with cursor.copy(COPY_EMBEDDINGS_SQL) as copy:
+                        copy.write(buf.getvalue())
+
+            # After an append the hash no longer describes the whole collection
+            if appending:
+                content_hash = None
+            elif content_hash is None:
+                content_hash = _content_hash(docs, self.embeddings)
+            # LangChain stores a JSON null when the collection has no metadata; merge into
+            # an object only, since jsonb `null || {...}` would build an array
+            connection.execute(
+                text(
+                    "UPDATE langchain_pg_collection SET cmetadata = (CASE "
+                    "WHEN CAST(:hash AS text) IS NULL THEN metadata - 'content_hash' "
+                    "ELSE metadata || jsonb_build_object('content_hash', CAST(:hash AS text)) "
+                    "END)::json "
+                    "FROM (SELECT CASE WHEN jsonb_typeof(cmetadata::jsonb) = 'object' "
+                    "THEN cmetadata::jsonb ELSE '{}'::jsonb END AS metadata "
+                    "FROM langchain_pg_collection WHERE uuid = :id) AS current "
+                    "WHERE uuid = :id"
+                ),
+                {"hash": content_hash, "id": collection_id},
+            )
+        logging.info(f"Inserted {len(docs)} embeddings into {collection_name}")
+
+    def ensure_index(self, method=None) -> None:
+        """
+        Build the ANN index (cosine ops) on langchain_pg_embedding, sized for the number
+        of stored vectors. Without it every search is an exact scan over all rows.
+        method: "hnsw" or "ivfflat". None keeps the existing index type; with no index yet,
+        large tables (IVFFLAT_MIN_VECTORS) get IVFFlat, which builds much faster.
+        The index is only rebuilt when its parameters change; with method=None an IVFFlat
+        index is kept while its list count is within 2x of the size-based target.
+        Indexing pins the shared embedding column to the current vector dimension for
+        good, so afterwards every collection must use an embedding model of that size.
+        """
+        with self.engine.begin() as connection:
+            # The index covers every collection, so size it by the whole table
+            vector_count = connection.execute(
+                text("SELECT count(*) FROM langchain_pg_embedding")
+            ).scalar()
+            if not vector_count:
+                return
+
+            # Indexes need a fixed dimension; LangChain creates the column as plain `vector`
+            type_name, dims = self._get_embedding_type(connection)
+            if dims is None:
+                dims = connection.execute(
+                    text("SELECT vector_dims(embedding) FROM langchain_pg_embedding LIMIT 1")
+                ).scalar()
+                connection.execute(
+                    text(
+                        f"ALTER TABLE langchain_pg_embedding "
+                        f"ALTER COLUMN embedding TYPE vector({dims})"
+                    )
+                )
+            self.embedding_type = (type_name, dims)
+
+            explicit = method is not None
+            if method is None:
+                # The index spans all collections, so don't switch type on a small update
+                has_ivfflat, has_hnsw = connection.execute(
+                    text(
+                        "SELECT to_regclass(:ivfflat) IS NOT NULL, "
+                        "to_regclass(:hnsw) IS NOT NULL"
+                    ),
+                    {"ivfflat": IVFFLAT_INDEX_NAME, "hnsw": HNSW_INDEX_NAME},
+                ).one()
+                if has_ivfflat:
+                    method = "ivfflat"
+                elif has_hnsw:
+                    method = "hnsw"
+                else:
+                    method = "ivfflat" if vector_count > IVFFLAT_MIN_VECTORS else "hnsw"
+
+            if method == "ivfflat":
+                index_name, other_index = IVFFLAT_INDEX_NAME, HNSW_INDEX_NAME
+                options = {"lists": configure_ivfflat_lists(vector_count)}
+            else:
+                index_name, other_index = HNSW_INDEX_NAME, IVFFLAT_INDEX_NAME
+                m, ef_construction, self.ef_search = configure_hnsw_params(vector_count)
+                options = {"m": m, "ef_construction": ef_construction}
+
+            existing = connection.execute(
+                text("SELECT reloptions FROM pg_class WHERE relname = :name"),
+                {"name": index_name},
+            ).scalar()
+            wanted = [f"{key}={value}" for key, value in options.items()]
+            if existing is not None and sorted(existing) == sorted(wanted):
+                return
+            if existing is not None and method == "ivfflat" and not explicit:
+                # The target follows sqrt(rows), so rebuilding on every change would
+                # re-cluster the whole table every few hundred rows; allow some drift
+                current = dict(option.split("=", 1) for option in existing)
+                lists = int(current.get("lists", 0))
+                if options["lists"] / 2 <= lists <= options["lists"] * 2:
+                    return
+
+            # Build settings only last for this transaction
+            connection.execute(text("SET LOCAL max_parallel_maintenance_workers = 7"))
+            connection.execute(text("SET LOCAL maintenance_work_mem = '2GB'"))
+            connection.execute(text(f"DROP INDEX IF EXISTS {other_index}"))
+            connection.execute(text(f"DROP INDEX IF EXISTS {index_name}"))
+            with_clause = ", ".join(f"{key} = {value}" for key, value in options.items())
+            connection.execute(
+                text(
+                    f"CREATE INDEX {index_name} ON langchain_pg_embedding "
+                    f"USING {method} (embedding {type_name}_cosine_ops) WITH ({with_clause})"
+                )
             )
 
+    def _parallel_embed(self, texts, batch=64, workers=None):
+        """
+        Embed texts in batches of `batch`, with up to `workers` batches in flight at once
+        (default: EMBED_PARALLELISM env var, else 8). Results keep the input order.
+        Local models get one worker: they are compute-bound and batch internally, so
+        threads sharing one model only contend for the CPU/GPU.
+        """
+        if workers is None:
+            if type(self.embeddings).__name__ in LOCAL_EMBEDDING_CLASSES:
+                workers = 1
+            else:
+                workers = max(1, int(os.getenv("EMBED_PARALLELISM", "8")))
+        batches = [texts[i : i + batch] for i in range(0, len(texts), batch)]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(self.embeddings.embed_documents, batches)
+        return [vector for vectors in results for vector in vectors]
+
+    def migrate_to_halfvec(self) -> None:
+        """
+        Store embeddings as halfvec (16-bit floats) instead of vector (32-bit).
+        Halves table and index size; cosine ranking is practically unchanged.
+        New rows inserted as vector are converted automatically.
+        """
+        with self.engine.begin() as connection:
+            type_name, dims = self._get_embedding_type(connection)
+            if type_name == "halfvec":
+                return
+            if dims is None:
+                dims = connection.execute(
+                    text("SELECT vector_dims(embedding) FROM langchain_pg_embedding LIMIT 1")
+                ).scalar()
+            if dims is None:
+                logging.info("No embeddings stored yet, skipping halfvec migration")
+                return
+            logging.info(f"Migrating embedding column to halfvec({dims})")
+            # The old index uses vector_cosine_ops; it is rebuilt with halfvec_cosine_ops below
+            had_ivfflat = connection.execute(
+                text("SELECT to_regclass(:name) IS NOT NULL"), {"name": IVFFLAT_INDEX_NAME}
+            ).scalar()
+            connection.execute(text(f"DROP INDEX IF EXISTS {HNSW_INDEX_NAME}"))
+            connection.execute(text(f"DROP INDEX IF EXISTS {IVFFLAT_INDEX_NAME}"))
+            connection.execute(
+                text(
+                    f"ALTER TABLE langchain_pg_embedding ALTER COLUMN embedding "
+                    f"TYPE halfvec({dims}) USING embedding::halfvec({dims})"
+                )
+            )
+        self.embedding_type = ("halfvec", dims)
+        self.ensure_index("ivfflat" if had_ivfflat else "hnsw")
+
+    @staticmethod
+    def _get_embedding_type(connection):
+        """Return (type name, dims) of the embedding column. dims is None if not fixed."""
+        type_name, typmod = PgvectorService._get_column_type(connection, "embedding")
+        return type_name, (typmod if typmod > 0 else None)
+
+    @staticmethod
+    def _get_column_type(connection, column):
+        """Return (type name, typmod) of a langchain_pg_embedding column."""
+        return tuple(
+            connection.execute(
+                text(
+                    "SELECT t.typname, a.atttypmod FROM pg_attribute a "
+                    "JOIN pg_type t ON t.oid = a.atttypid "
+                    "WHERE a.attrelid = 'langchain_pg_embedding'::regclass "
+                    "AND a.attname = :column"
+                ),
+                {"column": column},
+            ).one()
+        )
+
     def get_collections(self) -> list:
         """List all collection names in the database."""
         with self.engine.connect() as connection:
             try:
-                query = text("SELECT * FROM public.langchain_pg_collection")
+                query = text("SELECT name FROM public.langchain_pg_collection")
                 result = connection.execute(query)
                 collections = [row[0] for row in result]
-            except:
+            except ProgrammingError:
                 # If the table doesn't exist, return an empty list
                 collections = []
         return collections
 
+    def get_content_hash(self, collection_name):
+        """Content hash stored for a collection by bulk_upsert, or None."""
+        with self.engine.connect() as connection:
+            return connection.execute(
+                text(
+                    "SELECT cmetadata->>'content_hash' FROM langchain_pg_collection "
+                    "WHERE name = :name"
+                ),
+                {"name": collection_name},
+            ).scalar()
+
     def update_collection(self, docs, collection_name):
-        """Add or replace documents in a collection. Overwrites if collection exists."""
+        """
+        Add or replace documents in a collection. Overwrites if collection exists.
+        Does nothing if the collection already holds exactly these documents.
+        """
         logging.info(f"Updating collection: {collection_name}")
         collections = self.get_collections()
 
         if docs is not None:
             overwrite = collection_name in collections
-            self.update_pgvector_collection(docs, collection_name, overwrite)
+            content_hash = _content_hash(docs, self.embeddings)
+            if overwrite and self.get_content_hash(collection_name) == content_hash:
+                logging.info(f"Collection {collection_name} is unchanged, skipping")
+                return
+            # The index type is left to ensure_index, which sees the whole table
+            self.update_pgvector_collection(
+                docs, collection_name, overwrite, content_hash=content_hash
+            )
 
     def delete_collection(self, collection_name):
         """Remove a collection and all its embeddings from the database."""
         logging.info(f"Deleting collection: {collection_name}")
-        with self.engine.connect() as connection:
-            pgvector = PGVector(
-                collection_name=collection_name,
-                connection_string=self.cnx,
-                connection=connection,
-                embedding_function=self.embeddings,
-            )
-            pgvector.delete_collection()
+        pgvector = PGVector(
+            collection_name=collection_name,
+            connection_string=self.cnx,
+            embedding_function=self.embeddings,
+        )
+        pgvector.delete_collection()